@@ -6,13 +6,21 @@ import plotly.express as px
 
 try:
     from nft_api import NftApi
+    from utils.refresh_scheduler import RefreshScheduler
 except ModuleNotFoundError:
     from nft_research.nft_api import NftApi
+    from nft_research.utils.refresh_scheduler import RefreshScheduler
 
 rumble_kongs_contract_address = '0xef0182dc0574cd5874494a120750fd222fdb909a'
 rebel_bots_contract_address = '0xbbe23e96c48030dc5d4906e73c4876c254100d33'
 
-api = NftApi(contract_address=rumble_kongs_contract_address, use_cache=True)
+# Crawls hourly and follows other workers' snapshots every minute on a background thread.
+# Callbacks read scheduler.current so they never see a partial refresh.
+scheduler = RefreshScheduler(api_factory=lambda: NftApi(contract_address=rumble_kongs_contract_address,
+                                                        use_cache=True,
+                                                        use_snapshot=True),
+                             interval=3600,
+                             follow_interval=60).start()
 external_stylesheets = [
     {
         "href": "https://fonts.googleapis.com/css2?"
@@ -22,82 +30,119 @@ external_stylesheets = [
 ]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = 'NFT Data Analytics'
+# Exposed for gunicorn, e.g. gunicorn -w 4 app:server
+server = app.server
 
-app.layout = html.Div(
-    children=[
-        html.Div(children=[
-            html.H1(
-                children=f'PRT Capital Research',
-                className='header-title',
-            ),
-            html.P(
-                children=f'Contract Address of Research: {api.contract_address}',
-                className='header-description',
+
+def format_data_age(seconds):
+    """Function to format the data age for the header."""
+    if seconds is None:
+        return 'Data age: loading, refresh the page shortly'
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f'Data age: {h}h{m:02d}m'
+
+
+def serve_layout():
+    """Function to build the layout from the current data on each page load."""
+    api = scheduler.current
+    # Until the background thread has loaded the data, touching it here would run the crawl on the request.
+    if scheduler.ready.is_set():
+        sale_prices = api.assets_data[api.assets_data['sell_order_1_eth_price'] < 5.0]['sell_order_1_eth_price']
+    else:
+        sale_prices = []
+    return html.Div(
+        children=[
+            html.Div(children=[
+                html.H1(
+                    children=f'PRT Capital Research',
+                    className='header-title',
+                ),
+                html.P(
+                    children=f'Contract Address of Research: {api.contract_address}',
+                    className='header-description',
+                ),
+                html.P(
+                    id='data_age',
+                    children=format_data_age(scheduler.data_age),
+                    className='header-description',
+                ),
+                dcc.Interval(id='data_age_interval', interval=60 * 1000),
+            ],
+                className='header',
             ),
-        ],
-            className='header',
-        ),
-        html.Div(
-            children=[
-                # html.Div(
-                #     dcc.Graph(
-                #         figure={
-                #             'cache': [
-                #                 {
-                #                     'x': api.transactions_per_day.index,
-                #                     'y': api.transactions_per_day.values,
-                #                     'type': 'bar',
-                #                 },
-                #             ],
-                #             'layout': {'title': 'Transactions Per Day'},
-                #         },
-                #     ),
-                #     className='card',
-                # ),
-                html.Div(
-                    dcc.Graph(
-                        figure={
-                            'cache': [
-                                {
-                                    'x': api.assets_data[api.assets_data['sell_order_1_eth_price'] < 5.0]['sell_order_1_eth_price'],
-                                    'histfunc': 'count',
-                                    'type': 'histogram',
+            html.Div(
+                children=[
+                    # html.Div(
+                    #     dcc.Graph(
+                    #         figure={
+                    #             'cache': [
+                    #                 {
+                    #                     'x': api.transactions_per_day.index,
+                    #                     'y': api.transactions_per_day.values,
+                    #                     'type': 'bar',
+                    #                 },
+                    #             ],
+                    #             'layout': {'title': 'Transactions Per Day'},
+                    #         },
+                    #     ),
+                    #     className='card',
+                    # ),
+                    html.Div(
+                        dcc.Graph(
+                            figure={
+                                'cache': [
+                                    {
+                                        'x': sale_prices,
+                                        'histfunc': 'count',
+                                        'type': 'histogram',
+                                    },
+                                ],
+                                'layout': {
+                                    'title': 'Histogram of Live for Sales',
+                                    'bargap': 0.1
                                 },
-                            ],
-                            'layout': {
-                                'title': 'Histogram of Live for Sales',
-                                'bargap': 0.1
                             },
-                        },
+                        ),
+                        className='card',
                     ),
-                    className='card',
-                ),
-                html.Div(
-                    children=[
-                        html.Div([
-                            html.Div([
-                                'Max Eth Price: ',
-                                dcc.Input(
-                                    id='max_eth_input',
-                                    value=9999,
-                                    type='text')
-                            ], style={'width': '48%', 'display': 'inline-block'}),
+                    html.Div(
+                        children=[
                             html.Div([
-                                dcc.Dropdown(
-                                    id='x_axis_value',
-                                    options=[{'label': i, 'value': i} for i in
-                                             ['Defense', 'Vision', 'Shooting', 'Finish', 'sum_boost_scores']],
-                                    value='Defense'
-                                ),
-                            ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'}),
-                        ], style={'display': 'flex', 'flex-direction': 'row', 'padding': 10}),
-                        dcc.Graph(id='all_boost_scatter'),
-                    ], className='card', style={'padding': 10},
-                ),
-            ], className='wrapper',
-        ),
-    ]
+                                html.Div([
+                                    'Max Eth Price: ',
+                                    dcc.Input(
+                                        id='max_eth_input',
+                                        value=9999,
+                                        type='text')
+                                ], style={'width': '48%', 'display': 'inline-block'}),
+                                html.Div([
+                                    dcc.Dropdown(
+                                        id='x_axis_value',
+                                        options=[{'label': i, 'value': i} for i in
+                                                 ['Defense', 'Vision', 'Shooting', 'Finish', 'sum_boost_scores']],
+                                        value='Defense'
+                                    ),
+                                ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'}),
+                            ], style={'display': 'flex', 'flex-direction': 'row', 'padding': 10}),
+                            dcc.Graph(id='all_boost_scatter'),
+                        ], className='card', style={'padding': 10},
+                    ),
+                ], className='wrapper',
+            ),
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
+@app.callback(
+    dash.dependencies.Output('data_age', 'children'),
+    [dash.dependencies.Input('data_age_interval', 'n_intervals')]
 )
+def update_data_age(n_intervals):
+    return format_data_age(scheduler.data_age)
 
 
 @app.callback(
@@ -106,7 +151,9 @@ app.layout = html.Div(
      dash.dependencies.Input('x_axis_value', 'value')]
 )
 def update_all_boost_values_graph(max_eth_input, x_axis_value, title='Shooting'):
-    df = api.rkl_boost_values.copy(deep=True)
+    if not scheduler.ready.is_set():
+        return {}
+    df = scheduler.current.rkl_boost_values.copy(deep=True)
     print(max_eth_input)
     df = df[df['eth_sale_price'] <= float(max_eth_input)].copy(deep=True)
     fig = px.scatter(x=df[x_axis_value].astype(float),
@@ -0,0 +1,248 @@
+"""
+Module to time and memory-profile each NftApi stage against synthetic OpenSea data.
+
+Run from the repo root, e.g.
+    python -m benchmarks.run_benchmarks --scales 10000 100000 --events-ratio 0.5
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+
+import argparse
+import gc
+import json
+import logging
+import pathlib
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    from nft_research.nft_api import NftApi
+    from nft_research.benchmarks.synthetic_data import generate_assets, generate_events
+except ModuleNotFoundError:
+    from nft_api import NftApi
+    from benchmarks.synthetic_data import generate_assets, generate_events
+
+
+RKL_CONTRACT_ADDRESS = '0xef0182dc0574cd5874494a120750fd222fdb909a'
+RESULTS_DIR = pathlib.Path(__file__).parent.absolute().joinpath('results')
+
+
+class SyntheticNftApi(NftApi):
+    """
+    Class to run the NftApi stages against synthetic payloads in a throwaway cache dir.
+    """
+
+    def __init__(self, assets, events, base_dir, **kwargs):
+        """Initialise a new instance of the SyntheticNftApi."""
+        self.base_dir = pathlib.Path(base_dir)
+        self.synthetic_assets = assets
+        self.synthetic_events = events
+        super(SyntheticNftApi, self).__init__(contract_address=RKL_CONTRACT_ADDRESS,
+                                              count_assets=len(assets),
+                                              **kwargs)
+        self.logger.setLevel(logging.WARNING)
+
+    def get_raw_assets_data(self, token_ids=None):
+        """Function to return the synthetic assets in place of the OpenSea crawl."""
+        if token_ids is None:
+            return self.synthetic_assets
+        token_ids = set(str(token_id) for token_id in token_ids)
+        return [row for row in self.synthetic_assets if row['token_id'] in token_ids]
+
+    def get_raw_events_data(self):
+        """Function to return the synthetic events in place of the OpenSea crawl."""
+        return self.synthetic_events
+
+
+def benchmark_stages(api):
+    """Function to return the (stage name, callable) pairs to benchmark, run in order against one api."""
+    state = {}
+
+    def parse_assets():
+        state['parsed'] = api.parse_raw_assets_data(data=api.synthetic_assets)
+        api.assets_data = state['parsed']['assets']
+        api.raw_traits_data = state['parsed']['traits']
+        return len(state['parsed']['assets'])
+
+    def parse_events():
+        api.events_data = api.raw_events_data
+        return len(api.events_data)
+
+    def write_parquet_cache():
+        state['parsed']['assets'].to_parquet(api.assets_cache_path)
+        state['parsed']['traits'].to_parquet(api.traits_cache_path)
+        return len(state['parsed']['assets'])
+
+    def read_parquet_cache():
+        return len(pd.read_parquet(api.assets_cache_path)) + len(pd.read_parquet(api.traits_cache_path))
+
+    def write_snapshot():
+        api.write_snapshot()
+        return len(api.assets_data)
+
+    def read_snapshot():
+        reader = SyntheticNftApi(assets=[], events=[], base_dir=api.base_dir, use_snapshot=True)
+        return len(reader.assets_data) + len(reader.raw_traits_data) + len(reader.rkl_boost_values)
+
+    def traits_data():
+        api._reset_lazy_properties('traits_data')
+        return len(api.traits_data)
+
+    def rkl_boost_values():
+        assert api.snapshot_version is None, 'rkl_boost_values must be aggregated, not read from a snapshot'
+        api._reset_lazy_properties('rkl_boost_values')
+        return len(api.rkl_boost_values)
+
+    def transactions_per_day():
+        api._reset_lazy_properties('transactions_per_day')
+        return len(api.transactions_per_day)
+
+    def plotly_report_fig():
+        api._reset_lazy_properties('plotly_plotter')
+        return len(api.plotly_plotter.report_fig.data)
+
+    def bokeh_report():
+        api._reset_lazy_properties('plotter')
+        return len(api.plotter.bokeh_report.tabs)
+
+    # The snapshot stages run last: write_snapshot pins api to the snapshot, after which the lazy properties
+    # would be re-read from Arrow instead of recomputed.
+    return [('parse_assets', parse_assets),
+            ('parse_events', parse_events),
+            ('write_parquet_cache', write_parquet_cache),
+            ('read_parquet_cache', read_parquet_cache),
+            ('traits_data', traits_data),
+            ('rkl_boost_values', rkl_boost_values),
+            ('transactions_per_day', transactions_per_day),
+            ('plotly_report_fig', plotly_report_fig),
+            ('bokeh_report', bokeh_report),
+            ('write_snapshot', write_snapshot),
+            ('read_snapshot', read_snapshot)]
+
+
+def run_pipeline(assets, events, profile_memory):
+    """Function to run every stage once, returning {stage: {'rows', 'seconds'|'peak_mb', 'error'}}."""
+    output = {}
+    with tempfile.TemporaryDirectory() as base_dir:
+        api = SyntheticNftApi(assets=assets, events=events, base_dir=base_dir)
+        for name, stage in benchmark_stages(api):
+            gc.collect()
+            if profile_memory:
+                tracemalloc.start()
+            ts = time.perf_counter()
+            try:
+                rows = stage()
+                error = None
+            except Exception as e:
+                rows, error = None, f'{type(e).__name__}: {e}'
+            te = time.perf_counter()
+            output[name] = {'rows': rows, 'error': error}
+            if profile_memory:
+                # tracemalloc sees Python and numpy allocations, not Arrow's memory pool.
+                output[name]['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+            else:
+                output[name]['seconds'] = te - ts
+    return output
+
+
+def run_benchmarks(scales, events_ratio=0.5, trait_types=4, max_sell_orders=1, repeat=1, profile_memory=True, seed=0):
+    """
+    Function to benchmark each stage at each scale.
+    Timings are the best of repeat runs, memory is profiled in a separate pass so tracing doesn't skew the timings.
+    """
+    results = []
+    for scale in scales:
+        assets = generate_assets(count=scale, trait_types=trait_types, max_sell_orders=max_sell_orders, seed=seed)
+        events = generate_events(count=int(scale * events_ratio), asset_count=scale, seed=seed)
+        timings = [run_pipeline(assets=assets, events=events, profile_memory=False) for _ in range(repeat)]
+        memory = run_pipeline(assets=assets, events=events, profile_memory=True) if profile_memory else {}
+        for stage in timings[0]:
+            results.append({'stage': stage,
+                            'scale': scale,
+                            'events': len(events),
+                            'rows': timings[0][stage]['rows'],
+                            'seconds': None if timings[0][stage]['error'] else min(t[stage]['seconds'] for t in timings),
+                            'peak_mb': memory.get(stage, {}).get('peak_mb'),
+                            'error': timings[0][stage]['error']})
+            seconds, peak_mb = results[-1]['seconds'], results[-1]['peak_mb']
+            print(f"{stage:>22} @ {scale:>8}: {float('nan') if seconds is None else seconds:8.3f}s "
+                  f"{float('nan') if peak_mb is None else peak_mb:9.1f}MB {results[-1]['error'] or ''}")
+    return results
+
+
+def git_commit():
+    """Function to return the current git commit, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=pathlib.Path(__file__).parent,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, params, output_dir=RESULTS_DIR):
+    """Function to save the results to <output_dir>/<commit>_<timestamp>.json."""
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    commit = git_commit()
+    time_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = output_dir.joinpath(f'{commit or "nocommit"}_{time_stamp}.json')
+    payload = {'commit': commit,
+               'timestamp': time_stamp,
+               'python': platform.python_version(),
+               'pandas': pd.__version__,
+               'params': params,
+               'results': results}
+    path.write_text(json.dumps(payload, indent=2))
+    return path
+
+
+def compare_results(baseline_path, candidate_path):
+    """Function to return a DataFrame comparing two saved benchmark runs, ratio > 1 means the candidate is slower."""
+    frames = []
+    for label, path in [('baseline', baseline_path), ('candidate', candidate_path)]:
+        df = pd.DataFrame(json.loads(pathlib.Path(path).read_text())['results'])
+        frames.append(df.set_index(['stage', 'scale'])[['seconds', 'peak_mb']].add_prefix(f'{label}_'))
+    df = frames[0].join(frames[1], how='outer')
+    df['seconds_ratio'] = df['candidate_seconds'].divide(df['baseline_seconds'])
+    df['peak_mb_ratio'] = df['candidate_peak_mb'].divide(df['baseline_peak_mb'])
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the NftApi stages against synthetic OpenSea data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000])
+    parser.add_argument('--events-ratio', type=float, default=0.5, help='events generated per asset')
+    parser.add_argument('--trait-types', type=int, default=4)
+    parser.add_argument('--max-sell-orders', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default=str(RESULTS_DIR))
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'))
+    args = parser.parse_args()
+
+    if args.compare:
+        with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+            print(compare_results(*args.compare))
+    else:
+        params = {'scales': args.scales,
+                  'events_ratio': args.events_ratio,
+                  'trait_types': args.trait_types,
+                  'max_sell_orders': args.max_sell_orders,
+                  'repeat': args.repeat,
+                  'seed': args.seed}
+        results = run_benchmarks(scales=args.scales,
+                                 events_ratio=args.events_ratio,
+                                 trait_types=args.trait_types,
+                                 max_sell_orders=args.max_sell_orders,
+                                 repeat=args.repeat,
+                                 profile_memory=not args.no_memory,
+                                 seed=args.seed)
+        print(f'Saved results to {save_results(results=results, params=params, output_dir=args.output_dir)}')
@@ -0,0 +1,95 @@
+"""Module to generate synthetic OpenSea shaped asset and event payloads for benchmarking."""
+
+import random
+from datetime import datetime, timedelta
+
+
+RKL_TRAIT_TYPES = ['Defense', 'Vision', 'Shooting', 'Finish']
+
+_PAYMENT_TOKENS = [{'symbol': 'ETH', 'decimals': 18, 'eth_price': '1.000000000000000', 'usd_price': '3000.000000000000000'},
+                   {'symbol': 'WETH', 'decimals': 18, 'eth_price': '1.000000000000000', 'usd_price': '3000.000000000000000'},
+                   {'symbol': 'USDC', 'decimals': 6, 'eth_price': '0.000333333333333', 'usd_price': '1.000000000000000'}]
+
+
+def _address(rng):
+    """Function to return a random hex address."""
+    return '0x%040x' % rng.getrandbits(160)
+
+
+def _account(rng, with_user=0.8):
+    """Function to return a random account, with a username some of the time."""
+    account = {'address': _address(rng)}
+    account['user'] = {'username': f'user_{rng.randrange(10 ** 6)}'} if rng.random() < with_user else None
+    return account
+
+
+def generate_assets(count, trait_types=4, max_sell_orders=1, listed_fraction=0.2, seed=0):
+    """
+    Function to generate raw assets shaped like the OpenSea v1 assets endpoint.
+    :param count: number of assets, with token ids 1 to count.
+    :param trait_types: number of trait types per asset, the first four are the RKL boost traits.
+    :param max_sell_orders: maximum number of sell orders on a listed asset.
+    :param listed_fraction: fraction of assets with at least one sell order.
+    """
+    rng = random.Random(seed)
+    names = RKL_TRAIT_TYPES[:trait_types] + [f'Trait {i}' for i in range(len(RKL_TRAIT_TYPES), trait_types)]
+    start = datetime(2021, 1, 1)
+    assets = []
+    for token_id in range(1, count + 1):
+        traits = [{'trait_type': name,
+                   'value': rng.randint(1, 100) if name in RKL_TRAIT_TYPES else f'{name} {rng.randrange(20)}',
+                   'display_type': None,
+                   'max_value': None,
+                   'trait_count': rng.randrange(1, count + 1),
+                   'order': None}
+                  for name in names]
+        sell_orders = None
+        if rng.random() < listed_fraction:
+            sell_orders = []
+            for _ in range(rng.randint(1, max_sell_orders)):
+                token = rng.choice(_PAYMENT_TOKENS)
+                created = start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+                sell_orders.append({'current_price': str(int(rng.uniform(0.01, 10) * 10 ** token['decimals'])),
+                                    'payment_token_contract': token,
+                                    'sale_kind': rng.choice([0, 0, 0, 1]),
+                                    'created_date': created.isoformat(),
+                                    'closing_date': (created + timedelta(days=30)).isoformat()})
+        assets.append({'token_id': str(token_id),
+                       'name': f'Synthetic #{token_id}',
+                       'creator': _account(rng) if rng.random() < 0.9 else None,
+                       'owner': _account(rng),
+                       'traits': traits,
+                       'num_sales': rng.randrange(10),
+                       'sell_orders': sell_orders})
+    return assets
+
+
+def generate_events(count, asset_count=10000, bundle_fraction=0.02, max_bundle_size=5, seed=0):
+    """
+    Function to generate raw successful events shaped like the OpenSea v1 events endpoint.
+    :param count: number of events.
+    :param asset_count: events reference token ids 1 to asset_count.
+    :param bundle_fraction: fraction of events that are bundle sales.
+    """
+    rng = random.Random(seed)
+    start = datetime(2021, 1, 1)
+    events = []
+    for i in range(count):
+        token = rng.choice(_PAYMENT_TOKENS)
+        asset, asset_bundle = None, None
+        if rng.random() < bundle_fraction:
+            asset_bundle = {'assets': [{'token_id': str(rng.randint(1, asset_count))}
+                                       for _ in range(rng.randint(2, max_bundle_size))]}
+        else:
+            asset = {'token_id': str(rng.randint(1, asset_count))}
+        timestamp = start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        events.append({'event_type': 'successful',
+                       'asset': asset,
+                       'asset_bundle': asset_bundle,
+                       'transaction': {'transaction_hash': '0x%064x' % rng.getrandbits(256),
+                                       'timestamp': timestamp.isoformat()},
+                       'seller': _account(rng),
+                       'winner_account': _account(rng),
+                       'total_price': str(int(rng.uniform(0.01, 10) * 10 ** token['decimals'])),
+                       'payment_token': token})
+    return events
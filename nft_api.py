@@ -1,8 +1,9 @@
 """A module to get the NFT cache from OpenSea API."""
 
+import os
 import pathlib
 import requests
-import math
+import time
 import tqdm
 
 from collections import defaultdict
@@ -21,10 +22,18 @@ try:
     from nft_research.utils.plotting_utils import plot_table_from_df, bokeh_plot_by_date, bokeh_heading
     from nft_research.utils.timeit import timeit
     from nft_research.utils.logger import get_standard_logger
+    from nft_research.utils.token_coverage import TokenCoveragePlanner
+    from nft_research.utils.snapshot_utils import write_snapshot, current_snapshot, read_snapshot_frame
 except ModuleNotFoundError:
     from utils.plotting_utils import plot_table_from_df, bokeh_plot_by_date, bokeh_heading
     from utils.timeit import timeit
     from utils.logger import get_standard_logger
+    from utils.token_coverage import TokenCoveragePlanner
+    from utils.snapshot_utils import write_snapshot, current_snapshot, read_snapshot_frame
+
+
+class DeltaWindowTooWideError(RuntimeError):
+    """Raised when there are too many events since the last refresh to page through for a delta refresh."""
 
 
 class NftApi(object):
@@ -34,13 +43,23 @@ class NftApi(object):
     _opensea_assets_url = "https://api.opensea.io/api/v1/assets"
     _opensea_events_url = "https://api.opensea.io/api/v1/events"
 
-    def __init__(self, contract_address, count_assets=10000, use_cache=True):
-        """Initialise a new instance of the NFT API object."""
+    def __init__(self, contract_address, count_assets=10000, use_cache=True, use_snapshot=False,
+                 token_id_range=None, max_empty_probe_batches=3):
+        """
+        Initialise a new instance of the NFT API object.
+        :param use_snapshot: read assets/traits/boost values from the memory-mapped Arrow snapshot if one exists.
+        :param token_id_range: (first, last) token ids to crawl, defaults to (0, count_assets).
+        :param max_empty_probe_batches: empty batches in a row above the range before the crawl stops.
+        """
         self.logger = get_standard_logger(name='NftAPI',
                                           log_dir=self.base_dir.joinpath('logs'))
         self.contract_address = contract_address
         self.count_assets = count_assets
         self.use_cache = use_cache
+        self.use_snapshot = use_snapshot
+        self.token_id_range = token_id_range if token_id_range is not None else (0, count_assets)
+        self.max_empty_probe_batches = max_empty_probe_batches
+        self.asset_coverage = None
 
     @lazy_property
     def base_dir(self):
@@ -77,8 +96,22 @@ class NftApi(object):
         dir.mkdir(exist_ok=True)
         return dir.joinpath(f'{self.contract_address}.parquet')
 
+    @lazy_property
+    def snapshot_dir(self):
+        """Lazy property to hold the Arrow snapshot directory."""
+        dir = self.cache_dir.joinpath('snapshots', self.contract_address)
+        dir.mkdir(parents=True, exist_ok=True)
+        return dir
+
+    @lazy_property
+    def snapshot_version(self):
+        """Lazy property to hold the snapshot version this instance reads from, pinned on first access."""
+        return current_snapshot(self.snapshot_dir) if self.use_snapshot else None
+
     @lazy_property
     def assets_data(self):
+        if self.snapshot_version is not None:
+            return read_snapshot_frame(self.snapshot_version, 'assets')
         if self.use_cache and self.assets_cache_path.exists():
             return pd.read_parquet(self.assets_cache_path)
         else:
@@ -86,6 +119,8 @@ class NftApi(object):
 
     @lazy_property
     def raw_traits_data(self):
+        if self.snapshot_version is not None:
+            return read_snapshot_frame(self.snapshot_version, 'traits')
         if self.use_cache and self.traits_cache_path.exists():
             return pd.read_parquet(self.traits_cache_path)
         else:
@@ -101,7 +136,24 @@ class NftApi(object):
     @lazy_property
     def raw_assets_data(self):
         """Lazy property to hold the raw asset cache."""
-        data = self.get_raw_assets_data()
+        output = self.parse_raw_assets_data(data=self.get_raw_assets_data())
+        if self.cached_token_ids:
+            # The crawl only fetched the ids missing from the cache, so merge them in.
+            return self.merge_into_assets_cache(refreshed=output)
+        output['assets'].to_parquet(self.assets_cache_path)
+        output['traits'].to_parquet(self.traits_cache_path)
+        return output
+
+    @lazy_property
+    def cached_token_ids(self):
+        """Lazy property to hold the token ids already in the assets cache."""
+        if self.use_cache and self.assets_cache_path.exists() and self.traits_cache_path.exists():
+            return set(pd.read_parquet(self.assets_cache_path, columns=['name']).index.astype(str))
+        return set()
+
+    @timeit
+    def parse_raw_assets_data(self, data):
+        """Function to parse the raw assets cache into the assets and traits DataFrames."""
         output = defaultdict(dict)
         traits_data = []
         for row in data:
@@ -141,35 +193,194 @@ class NftApi(object):
                     output[token_id][f'{key}_eth_price'] = eth_price
                     output[token_id][f'{key}_usd_price'] = usd_price
         assets_df = pd.DataFrame.from_dict(output).T
-        assets_df.to_parquet(self.assets_cache_path)
         traits_df = pd.DataFrame(traits_data)
         for col in traits_df.columns:
             traits_df[col] = traits_df[col].astype(str)
-        traits_df.to_parquet(self.traits_cache_path)
         return {'assets': assets_df,
-                'traits': traits_data}
+                'traits': traits_df}
 
     @timeit
-    def get_raw_assets_data(self):
+    def get_raw_assets_data(self, token_ids=None):
         """Function to get the raw assets cache from Opensea"""
-        iterations = math.ceil(self.count_assets / 30)
+        if token_ids is not None:
+            return self.get_raw_assets_data_by_token_ids(token_ids=token_ids)
+        planner = TokenCoveragePlanner(cached_ids=self.cached_token_ids,
+                                       start_id=self.token_id_range[0],
+                                       end_id=self.token_id_range[1],
+                                       max_empty_batches=self.max_empty_probe_batches)
         output_data = []
-        for i in tqdm.tqdm(range(0, iterations)):
-            params = {'token_ids': list(range((i * 30)+1, (i * 30)+30)),
+        progress = tqdm.tqdm(total=planner.planned_count)
+        while True:
+            batch = planner.next_batch()
+            if not batch:
+                break
+            if progress.n + len(batch) > progress.total:
+                # Probe batches above the expected range weren't known up front.
+                progress.total = progress.n + len(batch)
+                progress.refresh()
+            params = {'token_ids': batch,
                       'asset_contract_address': self.contract_address,
                       'order_direction': 'desc',
                       'offset': '0',
-                      'limit': '30'}
+                      'limit': str(len(batch))}
             response = requests.request('GET', type(self)._opensea_assets_url, params=params)
             if response.status_code != 200:
                 self.logger.warn(f'Error collecting raw assets cache: {response.status_code}')
                 break
             data = response.json()['assets']
-            if not len(data):
-                break
+            planner.record(batch=batch, returned_ids=[row['token_id'] for row in data])
             output_data.extend(data)
+            progress.update(len(batch))
+        progress.close()
+        self.asset_coverage = planner.report()
+        self.logger.info(f'Asset coverage: {self.asset_coverage}')
+        if not self.asset_coverage['complete']:
+            self.logger.warn(f'Asset crawl incomplete for token ids {self.token_id_range}: {self.asset_coverage}')
         return output_data
 
+    def get_raw_assets_data_by_token_ids(self, token_ids):
+        """Function to get the raw assets cache from Opensea for the given token ids."""
+        token_ids = sorted(set(str(token_id) for token_id in token_ids), key=lambda x: (len(x), x))
+        output_data = []
+        for i in tqdm.tqdm(range(0, len(token_ids), 30)):
+            params = {'token_ids': token_ids[i:i+30],
+                      'asset_contract_address': self.contract_address,
+                      'order_direction': 'desc',
+                      'offset': '0',
+                      'limit': '30'}
+            response = requests.request('GET', type(self)._opensea_assets_url, params=params)
+            if response.status_code != 200:
+                # Partial data would be merged as if complete, so fail the whole fetch.
+                raise RuntimeError(f'Error collecting raw assets for {len(token_ids) - i} of {len(token_ids)} '
+                                   f'token ids: {response.status_code}')
+            output_data.extend(response.json()['assets'])
+        return output_data
+
+    @timeit
+    def get_changed_token_ids(self, occurred_after, event_types=('created', 'cancelled', 'successful'), max_pages=500):
+        """Function to get the token ids with listing/cancel/sale events since occurred_after from Opensea."""
+        occurred_after = int(pd.Timestamp(occurred_after).timestamp())
+        token_ids = set()
+        for event_type in event_types:
+            for i in range(0, max_pages):
+                params = {'asset_contract_address': self.contract_address,
+                          'event_type': event_type,
+                          'occurred_after': occurred_after,
+                          'offset': i*30,
+                          'limit': '30'}
+                headers = {'Accept': 'application/json'}
+                response = requests.request('GET', type(self)._opensea_events_url, headers=headers, params=params)
+                if response.status_code != 200:
+                    # Without the full event list we can't tell what changed, so the caller retries the window.
+                    raise RuntimeError(f'Error collecting {event_type} events: {response.status_code}')
+                data = response.json()['asset_events']
+                for event in data:
+                    if event['asset'] != None:
+                        token_ids.add(str(event['asset']['token_id']))
+                    elif event['asset_bundle'] != None:
+                        token_ids.update(str(asset['token_id']) for asset in event['asset_bundle']['assets'])
+                if len(data) < 30:
+                    break
+            else:
+                raise DeltaWindowTooWideError(f'Hit the {max_pages} page cap collecting {event_type} events, '
+                                              f'the window since {occurred_after} is too wide for a delta refresh')
+        return token_ids
+
+    @timeit
+    def delta_refresh(self, occurred_after=None):
+        """
+        Function to refresh only the assets with events since the last refresh and merge them into the caches.
+        :param occurred_after: timestamp to look for events from, defaults to the last write of the assets cache.
+        :return: set of the token ids that were refreshed, empty if nothing changed, None if the refresh failed.
+        """
+        if not (self.assets_cache_path.exists() and self.traits_cache_path.exists()):
+            self.logger.info('No assets cache found, running a full refresh.')
+            return self.full_refresh()
+
+        if occurred_after is None:
+            occurred_after = pd.Timestamp(self.assets_cache_path.stat().st_mtime, unit='s')
+        refresh_started = time.time()
+        try:
+            token_ids = self.get_changed_token_ids(occurred_after=occurred_after)
+        except DeltaWindowTooWideError as e:
+            # The window only grows while it fails, so re-crawl everything to move the cache forward.
+            self.logger.warn(f'{e}, running a full refresh.')
+            return self.full_refresh()
+        except RuntimeError as e:
+            self.logger.warn(f'Delta refresh skipped: {e}')
+            return None
+        if not token_ids:
+            self.logger.info(f'No asset changes since {occurred_after}.')
+            return token_ids
+
+        try:
+            data = self.get_raw_assets_data(token_ids=token_ids)
+        except RuntimeError as e:
+            # Leave the cache mtime alone so the next run retries the same event window.
+            self.logger.warn(f'Delta refresh skipped: {e}')
+            return None
+        refreshed = self.parse_raw_assets_data(data=data)
+        self.merge_into_assets_cache(refreshed=refreshed)
+        # Every changed id was fetched, so stamp the cache with the start of this refresh.
+        # Events during the crawl are then picked up next time.
+        os.utime(self.assets_cache_path, (refresh_started, refresh_started))
+        self.logger.info(f'Delta refresh updated {len(refreshed["assets"])} of {len(token_ids)} changed assets.')
+        return token_ids
+
+    @timeit
+    def full_refresh(self):
+        """
+        Function to re-crawl every asset, ignoring the cached ids, and rewrite the assets/traits caches.
+        :return: set of the token ids crawled, None if the crawl didn't complete.
+        """
+        refresh_started = time.time()
+        # An empty cached id set makes the planner request every id rather than just the missing ones.
+        self.cached_token_ids = set()
+        data = self.get_raw_assets_data()
+        if not self.asset_coverage['complete']:
+            # Overwriting the caches with a partial crawl would drop the assets it missed.
+            self.logger.warn(f'Full refresh incomplete, keeping the existing caches: {self.asset_coverage}')
+            self._reset_lazy_properties('cached_token_ids')
+            return None
+        output = self.parse_raw_assets_data(data=data)
+        output['assets'].to_parquet(self.assets_cache_path)
+        output['traits'].to_parquet(self.traits_cache_path)
+        os.utime(self.assets_cache_path, (refresh_started, refresh_started))
+
+        self.snapshot_version = None
+        self.raw_assets_data = output
+        self.assets_data = output['assets']
+        self.raw_traits_data = output['traits']
+        self._reset_lazy_properties('cached_token_ids', 'traits_data', 'rkl_boost_values', 'plotter', 'plotly_plotter')
+        return set(output['assets'].index)
+
+    def merge_into_assets_cache(self, refreshed):
+        """Function to merge freshly parsed assets/traits into the parquet caches, replacing any stale rows."""
+        assets_df = pd.read_parquet(self.assets_cache_path)
+        traits_df = pd.read_parquet(self.traits_cache_path)
+        assets_df = pd.concat([assets_df.drop(index=refreshed['assets'].index, errors='ignore'),
+                               refreshed['assets']])
+        # Traits are keyed by asset name rather than token id.
+        if len(refreshed['assets']):
+            traits_df = traits_df[~traits_df['name'].isin(refreshed['assets']['name'].astype(str))]
+        traits_df = pd.concat([traits_df, refreshed['traits']], ignore_index=True)
+
+        assets_df.to_parquet(self.assets_cache_path)
+        traits_df.to_parquet(self.traits_cache_path)
+
+        # The merged frames are newer than any snapshot, so derived values are rebuilt from them.
+        self.snapshot_version = None
+        self.assets_data = assets_df
+        self.raw_traits_data = traits_df
+        self._reset_lazy_properties('cached_token_ids', 'traits_data', 'rkl_boost_values', 'plotter', 'plotly_plotter')
+        return {'assets': assets_df,
+                'traits': traits_df}
+
+    def _reset_lazy_properties(self, *names):
+        """Function to clear the cached values of lazy properties so they are rebuilt on next access."""
+        for name in names:
+            self.__dict__.pop(f'_{name}', None)
+
     @lazy_property
     def events_data(self):
         if self.use_cache and self.raw_events_cache_path.exists():
@@ -253,6 +464,8 @@ class NftApi(object):
     @lazy_property
     def rkl_boost_values(self):
         """Lazy property to hold the RKL trait values."""
+        if self.snapshot_version is not None:
+            return read_snapshot_frame(self.snapshot_version, 'rkl_boost_values')
         sale_df = self.assets_data.set_index('name').copy(deep=True)
         sale_price = sale_df[sale_df['sell_order_1_sale_kind'].eq(0)]['sell_order_1_eth_price'].to_frame(name='eth_sale_price')
         if self.contract_address != '0xef0182dc0574cd5874494a120750fd222fdb909a':
@@ -264,6 +477,35 @@ class NftApi(object):
             df['sum_boost_scores'] = df.astype(float).sum(axis=1)
         return df.merge(sale_price, left_index=True, right_index=True, how='left')
 
+    @timeit
+    def write_snapshot(self):
+        """Function to write the assets/traits/boost values to a new Arrow snapshot and make it current."""
+        assets = self.assets_data.infer_objects()
+        for col in assets.columns:
+            if col.endswith('_date'):
+                assets[col] = pd.to_datetime(assets[col], errors='coerce')
+            elif col.endswith(('_price', '_sale_kind')) or col == 'num_sales':
+                assets[col] = pd.to_numeric(assets[col], errors='coerce')
+        # Typed columns are what let workers share the buffers, object columns get copied into each process.
+        frames = {'assets': assets,
+                  'traits': self.raw_traits_data,
+                  'rkl_boost_values': self.rkl_boost_values.apply(pd.to_numeric, errors='coerce')}
+        version = write_snapshot(snapshot_dir=self.snapshot_dir, frames=frames)
+        # The in-memory frames match what was just written, so pin to it.
+        self.snapshot_version = version
+        self.logger.info(f'Wrote snapshot {version.name}.')
+        return version
+
+    def reload_snapshot(self):
+        """Function to re-pin this instance to the current snapshot, returning True if it changed."""
+        version = current_snapshot(self.snapshot_dir)
+        if version is None or version == self.snapshot_version:
+            return False
+        self.snapshot_version = version
+        self._reset_lazy_properties('assets_data', 'raw_traits_data', 'traits_data', 'rkl_boost_values',
+                                    'cached_token_ids', 'plotter', 'plotly_plotter')
+        return True
+
     @lazy_property
     def plotter(self):
         """Lazy property to hold the plotter object."""
@@ -322,7 +564,7 @@ class NftDataPlotter(object):
         """Lazy property to hold the bokeh plot for the number of sales per day."""
         data = self.api.events_data.copy(deep=True)
         count_df = data.reset_index().resample('D', on='timestamp')['transaction_hash'].count()
-        price_df = data.resample('D', on='timestamp')['eth_price'].sum()
+        price_df = data.resample('D', on='timestamp')['eth_price'].sum().astype(float)
         df = price_df.divide(count_df).to_frame(name='avg_transaction_price_per_day')
         return bokeh_plot_by_date(df=df,
                                   title='Average ETH Transaction Price Per Day',
@@ -409,6 +651,12 @@ if __name__ == '__main__':
     # To save traits:
     # api.traits_data.to_csv('...')
 
+    # To refresh only the assets listed/cancelled/sold since the last run:
+    # api.delta_refresh()
+
+    # To share the caches zero-copy across app workers (NftApi(..., use_snapshot=True)):
+    # api.write_snapshot()
+
     # To get RKL boost values:
     api.rkl_boost_values
 
@@ -1,5 +1,7 @@
 """Module to generate the RKL map."""
 
+import argparse
+
 import pandas as pd
 import folium
 import io
@@ -9,31 +11,79 @@ import pathlib
 from selenium import webdriver
 # browser = webdriver.Firefox()
 
+try:
+    from nft_research.utils.icon_utils import preprocess_icons, build_sprite_sheet, image_to_data_uri
+except ModuleNotFoundError:
+    from icon_utils import preprocess_icons, build_sprite_sheet, image_to_data_uri
 
-world = folium.Map(
-    zoom_start=2.5,
-    location=[13.133932434766733, 16.103938729508073]
-)
 
 assets_dir = pathlib.Path(__file__).parent.parent.absolute().joinpath('assets')
 kongs_dir = assets_dir.joinpath('kongs')
+icon_cache_dir = assets_dir.parent.joinpath('cache', 'icons')
+
+
+def build_map(kong_df, icon_mode='inline', pixel_ratio=2):
+    """
+    Function to build the collector map.
+    :param icon_mode: 'inline' to embed one resized WebP per marker, 'sprite' to embed a single sprite sheet.
+    """
+    world = folium.Map(
+        zoom_start=2.5,
+        location=[13.133932434766733, 16.103938729508073]
+    )
+
+    kongs = kong_df.reset_index()
+    icon_sizes = []
+    for kong in kongs.itertuples():
+        size_width = 100 * kong.scaling_factor * kong.image_ratio_width / kong.image_ratio_height
+        size_height = 100 * kong.scaling_factor * kong.image_ratio_height / kong.image_ratio_width
+        icon_sizes.append((size_width, size_height))
+
+    icon_paths = preprocess_icons(icons=[(kongs_dir.joinpath(kong.kong_image_name), kong.scaling_factor, size)
+                                         for kong, size in zip(kongs.itertuples(), icon_sizes)],
+                                  cache_dir=icon_cache_dir,
+                                  pixel_ratio=pixel_ratio)
+
+    if icon_mode == 'sprite':
+        sprite_uri, (sheet_width, sheet_height), offsets = build_sprite_sheet(icon_paths)
+        world.get_root().header.add_child(folium.Element(
+            f'<style>.kong-sprite {{background-image: url({sprite_uri}); background-repeat: no-repeat;}}</style>'))
+
+    for i, kong in enumerate(kongs.itertuples()):
+        size_width, size_height = icon_sizes[i]
+        if icon_mode == 'sprite':
+            x, y, width, height = offsets[i]
+            scale_x, scale_y = size_width / width, size_height / height
+            style = (f'width: {size_width:.1f}px; height: {size_height:.1f}px; '
+                     f'background-size: {sheet_width * scale_x:.1f}px {sheet_height * scale_y:.1f}px; '
+                     f'background-position: -{x * scale_x:.1f}px -{y * scale_y:.1f}px;')
+            kong_icon = folium.features.DivIcon(html=f'<div class="kong-sprite" style="{style}"></div>',
+                                                icon_size=(size_width, size_height))
+        elif icon_mode == 'inline':
+            kong_icon = folium.features.CustomIcon(image_to_data_uri(icon_paths[i]), icon_size=(size_width, size_height))
+        else:
+            raise ValueError(f'Unknown icon_mode: {icon_mode}')
+        folium.Marker(
+            location=[kong.longitude, kong.latitude],
+            popup=kong.kong_name,
+            tooltip=kong.kong_name,
+            icon=kong_icon,
+        ).add_to(world)
+    return world
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the collector map.')
+    parser.add_argument('--icon-mode', choices=['inline', 'sprite'], default='inline',
+                        help='embed one WebP per marker, or a single sprite sheet')
+    parser.add_argument('--pixel-ratio', type=float, default=2, help='icon resolution relative to display size')
+    args = parser.parse_args()
+
+    kong_df = pd.read_csv(assets_dir.joinpath('map_kongs.csv'), index_col=0)
+    world = build_map(kong_df=kong_df, icon_mode=args.icon_mode, pixel_ratio=args.pixel_ratio)
+
+    # img_data = world._to_png(5)
+    # img = Image.open(io.BytesIO(img_data))
+    # img.save('ckc_map.png')
 
-kong_df = pd.read_csv(assets_dir.joinpath('map_kongs.csv'), index_col=0)
-
-for kong in kong_df.reset_index().itertuples():
-    size_width = 100 * kong.scaling_factor * kong.image_ratio_width / kong.image_ratio_height
-    size_height = 100 * kong.scaling_factor * kong.image_ratio_height / kong.image_ratio_width
-    kong_icon = folium.features.CustomIcon(str(kongs_dir.joinpath(kong.kong_image_name)), icon_size=(size_width, size_height))
-    kong_popup = f'<strong>{kong.kong_name}</strong><br>{kong.kong_text}'
-    folium.Marker(
-        location=[kong.longitude, kong.latitude],
-        popup=kong.kong_name,
-        tooltip=kong.kong_name,
-        icon=kong_icon,
-    ).add_to(world)
-
-# img_data = world._to_png(5)
-# img = Image.open(io.BytesIO(img_data))
-# img.save('ckc_map.png')
-
-world.save('ckc_map.html')
+    world.save('ckc_map.html')
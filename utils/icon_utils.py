@@ -0,0 +1,111 @@
+"""Module to hold the icon preprocessing utils for the collector map."""
+
+import base64
+import hashlib
+import io
+import math
+import pathlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+
+def file_hash(path, chunk_size=1 << 16):
+    """Function to return the sha1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def icon_cache_path(cache_dir, source_path, scaling_factor, size):
+    """Function to return the cache path for a resized icon, keyed by source hash and scaling factor."""
+    width, height = size
+    key = f'{file_hash(source_path)[:16]}_{float(scaling_factor):g}_{width}x{height}'
+    return pathlib.Path(cache_dir).joinpath(f'{key}.webp')
+
+
+def resize_icon(source_path, output_path, size, quality=80):
+    """Function to resize an icon to the given pixel size and save it as WebP."""
+    output_path = pathlib.Path(output_path)
+    if output_path.exists():
+        return output_path
+    with Image.open(source_path) as img:
+        img = img.convert('RGBA')
+        img = img.resize(size, Image.LANCZOS)
+        # Write to a temp file first so an interrupted run never leaves a truncated icon in the cache.
+        tmp_path = output_path.with_suffix('.tmp')
+        img.save(tmp_path, format='WEBP', quality=quality, method=6)
+    tmp_path.replace(output_path)
+    return output_path
+
+
+def _resize_icon_job(args):
+    """Function to unpack the arguments for resize_icon in a worker process."""
+    return resize_icon(*args)
+
+
+def preprocess_icons(icons, cache_dir, pixel_ratio=2, quality=80, max_workers=None):
+    """
+    Function to resize and compress the icons to their display size in parallel.
+    :param icons: iterable of (source_path, scaling_factor, (display_width, display_height)).
+    :param cache_dir: directory to hold the resized icons.
+    :param pixel_ratio: multiplier on the display size so markers stay sharp on high-dpi screens.
+    :return: list of paths to the resized icons, in the same order as icons.
+    """
+    cache_dir = pathlib.Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for source_path, scaling_factor, display_size in icons:
+        size = tuple(max(1, int(math.ceil(x * pixel_ratio))) for x in display_size)
+        output_path = icon_cache_path(cache_dir=cache_dir,
+                                      source_path=source_path,
+                                      scaling_factor=scaling_factor,
+                                      size=size)
+        jobs.append((str(source_path), str(output_path), size, quality))
+
+    # Members sharing an image resolve to the same cache entry, so only resize each one once.
+    pending = [job for job in dict((job[1], job) for job in jobs).values() if not pathlib.Path(job[1]).exists()]
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_resize_icon_job, pending))
+    return [pathlib.Path(job[1]) for job in jobs]
+
+
+def image_to_data_uri(path):
+    """Function to return the inline data uri for an image file."""
+    path = pathlib.Path(path)
+    encoded = base64.b64encode(path.read_bytes()).decode('ascii')
+    return f'data:image/{path.suffix.lstrip(".").lower()};base64,{encoded}'
+
+
+def build_sprite_sheet(icon_paths, quality=80):
+    """
+    Function to pack the icons into a single WebP sprite sheet.
+    :return: (data uri of the sprite sheet, (sheet width, sheet height), list of (x, y, width, height) per icon).
+    """
+    # De-duplicate so members sharing an icon only appear once in the sheet.
+    unique_paths = list(dict.fromkeys(str(path) for path in icon_paths))
+    images = [Image.open(path) for path in unique_paths]
+    try:
+        # Lay the icons out on a square-ish grid, WebP caps each side at 16383px so a single strip won't scale.
+        columns = max(1, int(math.ceil(math.sqrt(len(images)))))
+        cell_width = max(img.width for img in images)
+        cell_height = max(img.height for img in images)
+        rows = int(math.ceil(len(images) / columns))
+        sheet = Image.new('RGBA', (columns * cell_width, rows * cell_height), (0, 0, 0, 0))
+        offsets = {}
+        for i, (path, img) in enumerate(zip(unique_paths, images)):
+            x, y = (i % columns) * cell_width, (i // columns) * cell_height
+            sheet.paste(img, (x, y))
+            offsets[path] = (x, y, img.width, img.height)
+    finally:
+        for img in images:
+            img.close()
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, format='WEBP', quality=quality, method=6)
+    data_uri = f'data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode("ascii")}'
+    return data_uri, sheet.size, [offsets[str(path)] for path in icon_paths]
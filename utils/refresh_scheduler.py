@@ -0,0 +1,189 @@
+"""Module to hold the background refresh scheduler for the Dash app."""
+
+import fcntl
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    from nft_research.utils.snapshot_utils import current_snapshot
+except ModuleNotFoundError:
+    from utils.snapshot_utils import current_snapshot
+
+
+class RefreshScheduler(object):
+    """
+    Class to refresh the NFT data on a background thread and swap it in without blocking callbacks.
+
+    Each refresh builds a new NftApi instance off to the side, warms the frames the app reads, then swaps it in
+    with a single reference assignment. Callbacks should take scheduler.current once and read everything from
+    that instance, so they always see one consistent snapshot while older instances are left to in-flight requests.
+
+    Only the process holding the refresh lock crawls and writes a new snapshot, which it does every interval, backing
+    off from follow_interval up to interval after failed crawls. Every process checks for a newer snapshot every
+    follow_interval, so workers converge on it within that period. Existing parquet caches are served on start
+    even if the first crawl fails.
+    """
+
+    def __init__(self, api_factory, interval=3600, follow_interval=60, logger=None):
+        """
+        Initialise a new instance of the RefreshScheduler.
+        :param api_factory: callable returning a new NftApi instance, created with use_snapshot=True.
+        :param interval: seconds between crawls.
+        :param follow_interval: seconds between checks for a snapshot published by another process.
+        """
+        self.api_factory = api_factory
+        self.interval = interval
+        self.follow_interval = follow_interval
+        self.current = api_factory()
+        self.logger = logger if logger is not None else self.current.logger
+        self.lock_path = self.current.cache_dir.joinpath(f'{self.current.contract_address}.refresh.lock')
+        # Touched by whichever process last checked OpenSea successfully, so every worker can report it.
+        self.checked_path = self.current.cache_dir.joinpath(f'{self.current.contract_address}.refresh.checked')
+        # Holds the count of crawls failed in a row, its mtime is when the last one failed.
+        self.failed_path = self.current.cache_dir.joinpath(f'{self.current.contract_address}.refresh.failed')
+        self.checked_at = None
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def data_age(self):
+        """Property to hold the seconds since the current data was last confirmed against OpenSea, or None."""
+        if self.checked_at is None:
+            return None
+        return max(0.0, time.time() - self.checked_at)
+
+    def start(self):
+        """Function to start the refresh thread, which loads the current data before its first wait."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='RefreshScheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Function to stop the refresh thread after the current refresh."""
+        self._stop.set()
+
+    def _run(self):
+        """Function to run the refresh loop until stopped."""
+        self.refresh()
+        while not self._stop.wait(self.follow_interval):
+            self.refresh()
+
+    def refresh(self):
+        """Function to crawl if due and the lock is free, otherwise follow the latest snapshot. True if swapped."""
+        previous = self.current
+        try:
+            if not self.ready.is_set():
+                self._follow_snapshot()
+            if not self.ready.is_set():
+                # Serve whatever is cached straight away, a crawl that fails only leaves it stale.
+                self._load_cache()
+            if self._crawl_due():
+                self._try_crawl()
+            self._follow_snapshot()
+        except Exception as e:
+            self.logger.exception(f'Background refresh failed, keeping current data: {e}')
+        return self.current is not previous
+
+    def _crawl_due(self):
+        """Function to check the interval since any process last checked OpenSea, and the backoff after failures."""
+        now = time.time()
+        if self.failed_path.exists():
+            failures = int(self.failed_path.read_text() or 1)
+            backoff = min(self.interval, self.follow_interval * 2 ** failures)
+            if now - self.failed_path.stat().st_mtime < backoff:
+                return False
+        if not self.checked_path.exists():
+            return True
+        return now - self.checked_path.stat().st_mtime >= self.interval
+
+    @contextmanager
+    def _refresh_lock(self):
+        """Context manager to hold the refresh lock without blocking, yielding whether it was acquired."""
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _try_crawl(self):
+        """Function to crawl under the refresh lock, returning False if another process holds it."""
+        with self._refresh_lock() as acquired:
+            # Another process may have finished a crawl while we waited to get here.
+            if not acquired or not self._crawl_due():
+                return False
+            try:
+                succeeded = self._crawl()
+            except Exception:
+                self._record_failure()
+                raise
+            if succeeded:
+                self.checked_path.touch()
+                if self.failed_path.exists():
+                    self.failed_path.unlink()
+            else:
+                self._record_failure()
+            self.checked_at = self._last_checked()
+            return True
+
+    def _record_failure(self):
+        """Function to record a failed crawl so every process backs off before the next attempt."""
+        failures = int(self.failed_path.read_text() or 0) if self.failed_path.exists() else 0
+        self.failed_path.write_text(str(failures + 1))
+
+    def _crawl(self):
+        """Function to run a delta refresh on a new instance, publish it as a snapshot and swap it in."""
+        api = self.api_factory()
+        if api.delta_refresh() is None:
+            return False
+        # delta_refresh unpins the snapshot when it merged changes, or there may not be a snapshot yet.
+        if api.snapshot_version is None:
+            api.write_snapshot()
+        if not self.ready.is_set() or api.snapshot_version != self.current.snapshot_version:
+            self._swap(api)
+        return True
+
+    def _load_cache(self):
+        """Function to swap in the parquet caches when there's no snapshot, publishing one if we hold the lock."""
+        api = self.api_factory()
+        if api.snapshot_version is not None or not (api.assets_cache_path.exists() and api.traits_cache_path.exists()):
+            return
+        with self._refresh_lock() as acquired:
+            if acquired:
+                api.write_snapshot()
+        self._swap(api)
+        self.checked_at = self._last_checked()
+
+    def _follow_snapshot(self):
+        """Function to swap in a new instance if another process has published a newer snapshot."""
+        # Only a symlink read, so this is cheap enough to run every follow_interval.
+        version = current_snapshot(self.current.snapshot_dir)
+        if version is None:
+            return
+        if not self.ready.is_set() or version != self.current.snapshot_version:
+            self._swap(self.api_factory())
+        self.checked_at = self._last_checked()
+
+    def _last_checked(self):
+        """Function to return when the cached data was last confirmed against OpenSea, or None if never."""
+        # The cache mtime is stamped by each successful refresh, the marker also covers checks with no changes.
+        times = [path.stat().st_mtime for path in (self.checked_path, self.current.assets_cache_path) if path.exists()]
+        return max(times) if times else None
+
+    def _swap(self, api):
+        """Function to warm the frames the app reads on the new instance then make it current."""
+        api.assets_data
+        api.traits_data
+        api.rkl_boost_values
+        self.current = api
+        self.ready.set()
+        self.logger.info(f'Swapped in refreshed data from {api.snapshot_version}.')
@@ -0,0 +1,90 @@
+"""Module to hold the Arrow IPC snapshot utils shared across app worker processes."""
+
+import os
+import pathlib
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+
+CURRENT_LINK = 'current'
+NAT_VALUE = np.iinfo(np.int64).min
+
+
+def frame_to_table(df):
+    """
+    Function to convert a DataFrame to an Arrow table that pandas can read back without copying.
+    Arrow stores NaN/NaT as nulls, and columns with nulls are copied on conversion. Float columns therefore
+    keep NaN as a value and timestamp columns keep pandas' NaT sentinel instead.
+    """
+    table = pa.Table.from_pandas(df)
+    columns = []
+    for column in table.columns:
+        if column.null_count and pa.types.is_floating(column.type):
+            column = pc.fill_null(column, float('nan'))
+        elif column.null_count and pa.types.is_timestamp(column.type):
+            column = pc.fill_null(column.cast(pa.int64()), NAT_VALUE).cast(column.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=table.schema)
+
+
+def _pyarrow_string_dtype(arrow_type):
+    """Function to map Arrow string columns to pyarrow backed pandas strings, which wrap the mapped buffers."""
+    if arrow_type in (pa.string(), pa.large_string()):
+        return pd.StringDtype('pyarrow')
+    return None
+
+
+def write_snapshot(snapshot_dir, frames, keep=2):
+    """
+    Function to write a new versioned snapshot of the given DataFrames and atomically make it current.
+    :param snapshot_dir: directory holding the snapshot versions and the 'current' symlink.
+    :param frames: dict of name to DataFrame, each written to <name>.arrow.
+    :param keep: number of snapshot versions to keep on disk.
+    :return: path of the new snapshot version.
+    """
+    snapshot_dir = pathlib.Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    version_dir = snapshot_dir.joinpath(datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+    tmp_dir = version_dir.with_name(f'.{version_dir.name}.tmp')
+    tmp_dir.mkdir()
+    for name, df in frames.items():
+        # Uncompressed so readers can memory-map the buffers rather than decompress into private memory.
+        feather.write_feather(frame_to_table(df), tmp_dir.joinpath(f'{name}.arrow'), compression='uncompressed')
+    tmp_dir.rename(version_dir)
+
+    # Swap the symlink with a rename so readers only ever see the old or the new snapshot.
+    tmp_link = snapshot_dir.joinpath(f'.{CURRENT_LINK}.tmp')
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    os.symlink(version_dir.name, tmp_link)
+    os.replace(tmp_link, snapshot_dir.joinpath(CURRENT_LINK))
+
+    # Workers still mapping an old version keep their pages until they reopen, so unlinking it is safe.
+    versions = sorted(path for path in snapshot_dir.iterdir() if path.is_dir() and not path.is_symlink()
+                      and not path.name.startswith('.'))
+    for path in versions[:-keep]:
+        shutil.rmtree(path, ignore_errors=True)
+    return version_dir
+
+
+def current_snapshot(snapshot_dir):
+    """Function to return the resolved path of the current snapshot version, or None if there isn't one."""
+    link = pathlib.Path(snapshot_dir).joinpath(CURRENT_LINK)
+    if not link.is_symlink():
+        return None
+    return link.resolve()
+
+
+def read_snapshot_frame(version_dir, name):
+    """Function to read a DataFrame from a snapshot, memory-mapping the Arrow buffers."""
+    source = pa.memory_map(str(pathlib.Path(version_dir).joinpath(f'{name}.arrow')), 'r')
+    table = pa.ipc.open_file(source).read_all()
+    # split_blocks stops pandas consolidating columns, so numeric columns without nulls stay views on the map.
+    # Strings stay Arrow arrays rather than being copied into Python objects.
+    return table.to_pandas(split_blocks=True, types_mapper=_pyarrow_string_dtype)
@@ -2,7 +2,7 @@
 
 from functools import wraps
 from time import time
-import collections
+import collections.abc
 import numpy as np
 import pandas as pd
 
@@ -78,4 +78,4 @@ def hasmethod(obj, method_name):
 
 
 def callable(obj):
-    return isinstance(obj, collections.Callable)
+    return isinstance(obj, collections.abc.Callable)
@@ -0,0 +1,81 @@
+"""Module to plan which token ids to request when crawling a collection's assets."""
+
+
+class TokenCoveragePlanner(object):
+    """
+    Class to discover a collection's token ids and pack the uncached ones into full request batches.
+
+    The planner first walks the expected id range, start_id to end_id inclusive, then keeps probing ids above it
+    until max_empty_batches probe batches in a row come back empty, so a supply above end_id doesn't truncate the
+    crawl. Collections whose ids don't start near 0, or with gaps wider than max_empty_batches * batch_size, need
+    the range passing in explicitly.
+    """
+
+    def __init__(self, cached_ids=(), start_id=0, end_id=10000, batch_size=30, max_empty_batches=3):
+        """Initialise a new instance of the TokenCoveragePlanner."""
+        self.batch_size = batch_size
+        self.max_empty_batches = max_empty_batches
+        self.cached_ids = set(int(token_id) for token_id in cached_ids)
+        self.found_ids = set()
+        self.absent_ids = set()
+        self.requested_ids = set()
+        self._pending = sorted(set(range(start_id, end_id + 1)) - self.cached_ids)
+        self._probe_cursor = max([end_id] + list(self.cached_ids)) + 1
+        self._empty_probe_batches = 0
+        self._probe_batches = set()
+
+    @property
+    def planned_count(self):
+        """Property to hold the number of ids still queued from the expected range."""
+        return len(self._pending)
+
+    @property
+    def known_ids(self):
+        """Property to hold every token id known to exist."""
+        return self.cached_ids | self.found_ids
+
+    def next_batch(self):
+        """Function to return the next batch of token ids to request, or an empty list when coverage is complete."""
+        if self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            # Top up a short final batch with probe ids so every request is full size.
+            batch.extend(self._next_probe_ids(self.batch_size - len(batch)))
+            return batch
+        if self._empty_probe_batches >= self.max_empty_batches:
+            return []
+        batch = self._next_probe_ids(self.batch_size)
+        self._probe_batches.add(tuple(batch))
+        return batch
+
+    def _next_probe_ids(self, count):
+        """Function to return the next count uncached ids above the expected range."""
+        ids = []
+        while len(ids) < count:
+            if self._probe_cursor not in self.cached_ids:
+                ids.append(self._probe_cursor)
+            self._probe_cursor += 1
+        return ids
+
+    def record(self, batch, returned_ids):
+        """Function to record which of the requested token ids came back from the API."""
+        returned_ids = set(int(token_id) for token_id in returned_ids)
+        self.requested_ids.update(batch)
+        self.found_ids.update(returned_ids)
+        self.absent_ids.update(set(batch) - returned_ids)
+        if tuple(batch) in self._probe_batches:
+            self._probe_batches.discard(tuple(batch))
+            self._empty_probe_batches = 0 if returned_ids else self._empty_probe_batches + 1
+
+    def report(self):
+        """Function to return a summary of the crawl coverage."""
+        known = len(self.known_ids)
+        return {'known_ids': known,
+                'cached_ids': len(self.cached_ids),
+                'fetched_ids': len(self.found_ids),
+                'absent_ids': len(self.absent_ids),
+                'requested_ids': len(self.requested_ids),
+                'unrequested_ids': len(self._pending),
+                'min_id': min(self.known_ids) if known else None,
+                'max_id': max(self.known_ids) if known else None,
+                # A crawl that found no ids at all most likely searched the wrong range.
+                'complete': bool(known) and not self._pending and self._empty_probe_batches >= self.max_empty_batches}